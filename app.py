@@ -1,11 +1,32 @@
-from flask import Flask, render_template, request, jsonify
-from campus_orientation import LuojiaExplorer
+import math
+import os
+import re
+import shutil
+import uuid
+
+from flask import Flask, render_template, request, jsonify, send_from_directory
+from campus_orientation import LuojiaExplorer, RACE_CONFIG, THEME_POI_MAP
+from course_model import delete_course, evict_courses, load_course, save_course
+from event_bundle import TILE_URL, course_payload, export_bundle
+from gps_analysis import analyse_file, load_results, save_result
+from storage import file_lock
 
 app = Flask(__name__)
 
 # 初始化珞珈探秘助手
 assistant = LuojiaExplorer()
 
+# 组织者正在编辑的路线，按course_id保存在磁盘上，多个gunicorn worker共享同一目录
+COURSE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'courses')
+# 超过该时间（秒）未修改的路线会被清理，默认30天
+COURSE_TTL = int(os.environ.get('COURSE_TTL', 30 * 24 * 3600))
+COURSE_ID_PATTERN = re.compile(r'^[0-9a-f]{12}$')
+
+# 离线活动包的导出目录，每条路线一个子目录
+BUNDLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bundles')
+# GPS轨迹分析结果，按路线（赛事）分目录保存
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -16,6 +37,223 @@ def process_request():
     response = assistant.process_request(user_input)
     return jsonify({'response': response})
 
+def get_course(course_id):
+    """从磁盘读取路线，不存在或course_id无效时返回None"""
+    if not COURSE_ID_PATTERN.match(course_id):
+        return None
+    return load_course(COURSE_DIR, course_id, assistant.get_route)
+
+def course_lock(course_id):
+    """修改路线时的跨进程锁，避免多个worker同时读改写同一条路线"""
+    return file_lock(os.path.join(COURSE_DIR, course_id + '.lock'))
+
+def remove_course_files(course_id):
+    """删除路线及其离线活动包，轨迹分析结果保留"""
+    existed = delete_course(COURSE_DIR, course_id)
+    shutil.rmtree(os.path.join(BUNDLE_DIR, course_id), ignore_errors=True)
+    try:
+        os.remove(os.path.join(COURSE_DIR, course_id + '.lock'))
+    except FileNotFoundError:
+        pass
+    return existed
+
+def course_response(course, **extra):
+    """返回路线概览，以及根据当前路线重新生成的方案报告"""
+    data = {'summary': course.summary()}
+    meta = course.meta
+    if meta.get('mode') == 'professional':
+        data['response'] = assistant.format_professional_report(meta['race_type'], meta['start'], meta['end'], course)
+    elif meta.get('mode') == 'fun':
+        data['response'] = assistant.format_fun_report(meta['theme'], course)
+    data.update(extra)
+    return jsonify(data)
+
+@app.route('/courses', methods=['POST'])
+def create_course():
+    """生成一条可编辑的路线"""
+    mode = request.form.get('mode', 'professional')
+    if mode == 'professional':
+        race_type = request.form.get('race_type', '短距离')
+        if race_type not in RACE_CONFIG:
+            return jsonify({'error': '不支持的赛事类型'}), 400
+        course = assistant.build_professional_course(
+            race_type,
+            request.form.get('start', '武汉大学信息学部操场'),
+            request.form.get('end', '武汉大学文理学部操场')
+        )
+    elif mode == 'fun':
+        theme = request.form.get('theme', '文化体验')
+        if theme not in THEME_POI_MAP:
+            return jsonify({'error': '不支持的活动主题'}), 400
+        course = assistant.build_fun_course(theme)
+    else:
+        return jsonify({'error': '不支持的模式'}), 400
+    
+    for evicted in evict_courses(COURSE_DIR, COURSE_TTL):
+        remove_course_files(evicted)
+    
+    course_id = uuid.uuid4().hex[:12]
+    save_course(COURSE_DIR, course_id, course)
+    return course_response(course, course_id=course_id)
+
+@app.route('/courses/<course_id>', methods=['GET'])
+def show_course(course_id):
+    course = get_course(course_id)
+    if course is None:
+        return jsonify({'error': '路线不存在'}), 404
+    return course_response(course)
+
+@app.route('/courses/<course_id>', methods=['DELETE'])
+def remove_course(course_id):
+    """删除路线及其离线活动包"""
+    if not COURSE_ID_PATTERN.match(course_id):
+        return jsonify({'error': '路线不存在'}), 404
+    with course_lock(course_id):
+        existed = remove_course_files(course_id)
+    if not existed:
+        return jsonify({'error': '路线不存在'}), 404
+    return jsonify({'deleted': course_id})
+
+def form_number(key):
+    """读取表单中的有限数值，缺失时返回None，格式错误或为inf/nan时抛出ValueError"""
+    if key not in request.form:
+        return None
+    value = float(request.form[key])
+    if not math.isfinite(value):
+        raise ValueError(key)
+    return value
+
+@app.route('/courses/<course_id>/points/<int:index>', methods=['POST'])
+def move_point(course_id, index):
+    """移动点位或修改海拔，只重新计算相邻赛段"""
+    try:
+        elevation, lat, lng = form_number('elevation'), form_number('lat'), form_number('lng')
+    except ValueError:
+        return jsonify({'error': '坐标或海拔格式错误'}), 400
+    if (lat is None) != (lng is None):
+        return jsonify({'error': '请同时提供lat和lng'}), 400
+    if lat is None and elevation is None:
+        return jsonify({'error': '请提供lat/lng或elevation'}), 400
+    if elevation is not None:
+        elevation = round(elevation)
+    
+    if not COURSE_ID_PATTERN.match(course_id):
+        return jsonify({'error': '路线不存在'}), 404
+    with course_lock(course_id):
+        course = get_course(course_id)
+        if course is None:
+            return jsonify({'error': '路线不存在'}), 404
+        if not 0 <= index < len(course.points):
+            return jsonify({'error': '点位不存在'}), 400
+        if lat is not None:
+            changed = course.move_point(index, {'lat': lat, 'lng': lng}, elevation)
+        else:
+            changed = course.set_elevation(index, elevation)
+        save_course(COURSE_DIR, course_id, course)
+    return course_response(course, changed_legs=changed)
+
+@app.route('/courses/<course_id>/points/<int:index>/tasks/<int:task_index>', methods=['POST'])
+def update_task(course_id, index, task_index):
+    """修改点位上的一个任务"""
+    changes = {key: request.form[key] for key in ('name', 'description', 'type', 'difficulty') if key in request.form}
+    try:
+        for key in ('points', 'time_limit'):
+            if key in request.form:
+                changes[key] = int(request.form[key])
+    except ValueError:
+        return jsonify({'error': '分值或时间限制格式错误'}), 400
+    
+    if not COURSE_ID_PATTERN.match(course_id):
+        return jsonify({'error': '路线不存在'}), 404
+    with course_lock(course_id):
+        course = get_course(course_id)
+        if course is None:
+            return jsonify({'error': '路线不存在'}), 404
+        if not 0 <= index < len(course.points) or not 0 <= task_index < len(course.points[index]['tasks']):
+            return jsonify({'error': '任务不存在'}), 400
+        course.update_task(index, task_index, **changes)
+        save_course(COURSE_DIR, course_id, course)
+    return course_response(course)
+
+@app.route('/courses/<course_id>/bundle', methods=['POST'])
+def create_bundle(course_id):
+    """把当前路线导出为离线活动包
+
+    接口只打包磁盘缓存中已有的瓦片，不在请求中下载，避免冷缓存时逐个下载瓦片超过worker超时；
+    缓存需要预先用命令行 `python event_bundle.py --course <course_id>` 预热，manifest中的missing_tiles为缺少的瓦片数。
+    """
+    course = get_course(course_id)
+    if course is None:
+        return jsonify({'error': '路线不存在'}), 404
+    # 只有配置了TILE_URL才打包瓦片，tiles=0时跳过
+    tile_url = TILE_URL if request.form.get('tiles', '1') != '0' else None
+    try:
+        manifest = export_bundle(course, os.path.join(BUNDLE_DIR, course_id), tile_url=tile_url, download_tiles=False)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'manifest': manifest,
+        'manifest_url': f'/bundles/{course_id}/manifest.json',
+        'bundle_url': f'/bundles/{course_id}/{manifest["bundle"]}'
+    })
+
+@app.route('/bundles/<course_id>/manifest.json')
+def bundle_manifest(course_id):
+    """manifest每次都需要重新验证，以便发现新版本的活动包"""
+    if not COURSE_ID_PATTERN.match(course_id):
+        return jsonify({'error': '文件不存在'}), 404
+    response = send_from_directory(os.path.join(BUNDLE_DIR, course_id), 'manifest.json',
+                                   mimetype='application/json', max_age=0)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/bundles/<course_id>/<filename>')
+def bundle_file(course_id, filename):
+    """活动包文件名包含内容摘要，内容不会变化，可永久缓存"""
+    if not COURSE_ID_PATTERN.match(course_id) or not (filename.startswith('bundle-') and filename.endswith('.json.gz')):
+        return jsonify({'error': '文件不存在'}), 404
+    response = send_from_directory(os.path.join(BUNDLE_DIR, course_id), filename,
+                                   mimetype='application/json', etag=False)
+    response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    response.headers['ETag'] = f'"{filename[len("bundle-"):-len(".json.gz")]}"'
+    return response
+
+@app.route('/courses/<course_id>/tracks', methods=['POST'])
+def upload_tracks(course_id):
+    """上传GPX/FIT轨迹，与路线比对并保存分段用时
+
+    表单字段runner可按顺序为每个文件指定选手姓名，未指定时使用文件名。
+    """
+    course = get_course(course_id)
+    if course is None:
+        return jsonify({'error': '路线不存在'}), 404
+    files = request.files.getlist('tracks')
+    if not files:
+        return jsonify({'error': '请上传轨迹文件'}), 400
+    runners = request.form.getlist('runner')
+    if runners and len(runners) != len(files):
+        return jsonify({'error': 'runner的数量需要与轨迹文件数量一致'}), 400
+    
+    payload = course_payload(course)
+    results = []
+    for i, f in enumerate(files):
+        runner = runners[i].strip() if runners and runners[i].strip() else None
+        try:
+            result = analyse_file(payload, f.stream, f.filename, runner=runner)
+        except Exception as e:
+            # 单个文件损坏（截断的gz、非法XML、缺字段等）不影响同批其他文件
+            results.append({'file': f.filename, 'error': f'轨迹解析失败：{e}'})
+            continue
+        save_result(RESULTS_DIR, course_id, result)
+        results.append(result)
+    return jsonify({'results': results})
+
+@app.route('/courses/<course_id>/results', methods=['GET'])
+def show_results(course_id):
+    """查看赛事已保存的全部分析结果"""
+    return jsonify({'results': load_results(RESULTS_DIR, course_id)})
+
 if __name__ == '__main__':
     print(f"\n🚀 珞珈探秘·校园团建定向助手")
     print(f"🌐 本地访问地址: http://localhost:5000")
@@ -1,6 +1,329 @@
 import requests
 import json
 
+from course_model import Course
+from single_flight import SingleFlight
+
+# 武大校内预设控制点，包含更多详细信息
+PRESET_CONTROL_POINTS = [
+    {
+        "name": "CP1-信息学部操场",
+        "code": "1",
+        "location": {"lat": 30.5300, "lng": 114.3557},
+        "address": "武汉大学信息学部",
+        "elevation": 30,
+        "difficulty": 1
+    },
+    {
+        "name": "CP2-文理学部操场",
+        "code": "2",
+        "location": {"lat": 30.5370, "lng": 114.3600},
+        "address": "武汉大学文理学部",
+        "elevation": 28,
+        "difficulty": 1
+    },
+    {
+        "name": "CP3-万林艺术博物馆",
+        "code": "3",
+        "location": {"lat": 30.5390, "lng": 114.3576},
+        "address": "武汉大学文理学部",
+        "elevation": 32,
+        "difficulty": 1
+    },
+    {
+        "name": "CP4-老图书馆",
+        "code": "4",
+        "location": {"lat": 30.5380, "lng": 114.3610},
+        "address": "武汉大学樱顶",
+        "elevation": 45,
+        "difficulty": 2
+    },
+    {
+        "name": "CP5-信息学部图书馆",
+        "code": "5",
+        "location": {"lat": 30.5314, "lng": 114.3557},
+        "address": "武汉大学信息学部",
+        "elevation": 35,
+        "difficulty": 2
+    },
+    {
+        "name": "CP6-医学部",
+        "code": "6",
+        "location": {"lat": 30.5566, "lng": 114.3505},
+        "address": "武汉大学医学部",
+        "elevation": 22,
+        "difficulty": 1
+    },
+    {
+        "name": "CP7-工学部",
+        "code": "7",
+        "location": {"lat": 30.5450, "lng": 114.3650},
+        "address": "武汉大学工学部",
+        "elevation": 25,
+        "difficulty": 1
+    },
+    {
+        "name": "CP8-樱花大道",
+        "code": "8",
+        "location": {"lat": 30.5385, "lng": 114.3620},
+        "address": "武汉大学文理学部",
+        "elevation": 40,
+        "difficulty": 2
+    },
+    {
+        "name": "CP9-宋卿体育馆",
+        "code": "9",
+        "location": {"lat": 30.5375, "lng": 114.3630},
+        "address": "武汉大学文理学部",
+        "elevation": 35,
+        "difficulty": 2
+    },
+    {
+        "name": "CP10-十八栋",
+        "code": "10",
+        "location": {"lat": 30.5395, "lng": 114.3640},
+        "address": "武汉大学珞珈山",
+        "elevation": 50,
+        "difficulty": 3
+    }
+]
+
+# 赛事类型参数配置（IOF标准）
+RACE_CONFIG = {
+    "短距离": {
+        "name": "Sprint",
+        "control_points": 6-8,
+        "total_distance": 2.5-3.5,  # km
+        "max_climb": 100,  # m
+        "description": "短距离赛，注重技术和路线选择"
+    },
+    "百米定向": {
+        "name": "Park Sprint",
+        "control_points": 3-5,
+        "total_distance": 0.3-0.5,  # km
+        "max_climb": 20,  # m
+        "description": "百米定向，密集控制点，快速决策"
+    },
+    "积分赛": {
+        "name": "Score Orienteering",
+        "control_points": 10-15,
+        "total_distance": 4-6,  # km
+        "max_climb": 150,  # m
+        "description": "积分赛，自由选择路线，按完成时间和积分计算"
+    }
+}
+
+# 武大校内著名POI列表，包含详细的团建任务
+WUHAN_UNIVERSITY_POI = {
+    "樱花大道": {
+        "name": "武汉大学樱花大道",
+        "location": "30.5385,114.3620",
+        "clue": "寻找校园里最浪漫的花路，每年三月这里会变成粉色海洋。",
+        "address": "武汉大学文理学部",
+        "tasks": [
+            {
+                "name": "樱花创意合影",
+                "description": "团队全员参与，在樱花树下拍摄一张创意合影，必须包含樱花元素。",
+                "type": "拍照任务",
+                "difficulty": "简单",
+                "points": 10,
+                "time_limit": 5  # 分钟
+            },
+            {
+                "name": "樱花诗词接龙",
+                "description": "团队成员轮流说出带有'樱'或'花'字的诗词，至少完成5句。",
+                "type": "知识挑战",
+                "difficulty": "中等",
+                "points": 15,
+                "time_limit": 3  # 分钟
+            }
+        ]
+    },
+    "樱顶": {
+        "name": "武汉大学樱顶",
+        "location": "30.5380,114.3610",
+        "clue": "寻找樱花盛开时的最佳观赏点，俯瞰整个武大校园。",
+        "address": "武汉大学老图书馆旁",
+        "tasks": [
+            {
+                "name": "校训解密",
+                "description": "找到樱顶校训碑，集体朗读校训，并解释其含义。",
+                "type": "知识问答",
+                "difficulty": "简单",
+                "points": 10,
+                "time_limit": 4  # 分钟
+            },
+            {
+                "name": "校园俯瞰拼图",
+                "description": "从樱顶俯瞰校园，用手机拍摄3张不同角度的照片，拼成一张完整的校园全景图。",
+                "type": "创意挑战",
+                "difficulty": "中等",
+                "points": 20,
+                "time_limit": 6  # 分钟
+            }
+        ]
+    },
+    "老图书馆": {
+        "name": "武汉大学老图书馆",
+        "location": "30.5380,114.3610",
+        "clue": "寻找最高学府的最高点，这里见证了武大的百年历史。",
+        "address": "武汉大学樱顶",
+        "tasks": [
+            {
+                "name": "身体拼字",
+                "description": "团队成员用身体拼出'武大'或'珞珈'两个字，拍摄视频记录。",
+                "type": "团队协作",
+                "difficulty": "中等",
+                "points": 15,
+                "time_limit": 5  # 分钟
+            },
+            {
+                "name": "历史问答",
+                "description": "找出老图书馆的建造年份和建筑师。",
+                "type": "知识挑战",
+                "difficulty": "困难",
+                "points": 25,
+                "time_limit": 5  # 分钟
+            }
+        ]
+    },
+    "宋卿体育馆": {
+        "name": "武汉大学宋卿体育馆",
+        "location": "30.5375,114.3630",
+        "clue": "寻找以民国大总统命名的体育馆，它曾是远东最好的体育馆之一。",
+        "address": "武汉大学文理学部",
+        "tasks": [
+            {
+                "name": "两人三足挑战",
+                "description": "团队成员两两一组，完成20米的两人三足比赛，记录最快完成时间。",
+                "type": "运动挑战",
+                "difficulty": "中等",
+                "points": 20,
+                "time_limit": 8  # 分钟
+            },
+            {
+                "name": "篮球投篮比赛",
+                "description": "团队成员轮流投篮，在3分钟内投进最多球的团队获胜。",
+                "type": "运动挑战",
+                "difficulty": "简单",
+                "points": 15,
+                "time_limit": 5  # 分钟
+            }
+        ]
+    },
+    "十八栋": {
+        "name": "武汉大学十八栋",
+        "location": "30.5395,114.3640",
+        "clue": "寻找民国时期教授们的居所，感受老武大的人文气息。",
+        "address": "武汉大学珞珈山",
+        "tasks": [
+            {
+                "name": "老建筑探索",
+                "description": "找到一栋标有编号的老别墅，记录其编号、建筑风格特点和曾居住的名人。",
+                "type": "探索任务",
+                "difficulty": "困难",
+                "points": 30,
+                "time_limit": 10  # 分钟
+            },
+            {
+                "name": "自然寻宝",
+                "description": "在十八栋附近寻找5种不同的植物或动物，拍摄照片并记录名称。",
+                "type": "探索任务",
+                "difficulty": "中等",
+                "points": 20,
+                "time_limit": 8  # 分钟
+            }
+        ]
+    },
+    "万林艺术博物馆": {
+        "name": "武汉大学万林艺术博物馆",
+        "location": "30.5390,114.3576",
+        "clue": "寻找校园里最现代的建筑，它的外形像一块飞来的石头。",
+        "address": "武汉大学文理学部",
+        "tasks": [
+            {
+                "name": "传统与现代对比",
+                "description": "以'传统与现代'为主题，拍摄一张万林博物馆与武大老建筑的对比照片。",
+                "type": "拍照任务",
+                "difficulty": "中等",
+                "points": 20,
+                "time_limit": 6  # 分钟
+            },
+            {
+                "name": "建筑创意素描",
+                "description": "团队成员合作，用10分钟时间素描万林博物馆的外观，要求包含主要建筑特征。",
+                "type": "创意挑战",
+                "difficulty": "困难",
+                "points": 25,
+                "time_limit": 10  # 分钟
+            }
+        ]
+    },
+    "郭沫若铜像": {
+        "name": "武汉大学郭沫若铜像",
+        "location": "30.5370,114.3600",
+        "clue": "寻找著名文学家郭沫若先生的铜像，他曾担任武大校长。",
+        "address": "武汉大学文理学部",
+        "tasks": [
+            {
+                "name": "即兴短剧表演",
+                "description": "围绕郭沫若的文学作品或生平事迹，即兴表演一个1-2分钟的短剧。",
+                "type": "创意表演",
+                "difficulty": "中等",
+                "points": 25,
+                "time_limit": 10  # 分钟
+            },
+            {
+                "name": "诗歌朗诵",
+                "description": "团队成员集体朗诵一首郭沫若的诗歌，要求有感情地背诵。",
+                "type": "文化体验",
+                "difficulty": "简单",
+                "points": 15,
+                "time_limit": 5  # 分钟
+            }
+        ]
+    },
+    "工学部操场": {
+        "name": "武汉大学工学部操场",
+        "location": "30.5450,114.3650",
+        "clue": "寻找工学部的运动天地，这里是工科学子挥洒汗水的地方。",
+        "address": "武汉大学工学部",
+        "tasks": [
+            {
+                "name": "拔河比赛",
+                "description": "与其他团队进行一场5分钟的拔河比赛，获胜团队获得双倍积分。",
+                "type": "团队游戏",
+                "difficulty": "中等",
+                "points": 30,
+                "time_limit": 10  # 分钟
+            },
+            {
+                "name": "接力赛跑",
+                "description": "团队成员进行4x100米接力赛，记录完成时间。",
+                "type": "运动挑战",
+                "difficulty": "中等",
+                "points": 25,
+                "time_limit": 8  # 分钟
+            }
+        ]
+    }
+}
+
+# 团建主题任务映射
+THEME_POI_MAP = {
+    "樱花季": ["樱花大道", "樱顶", "老图书馆", "万林艺术博物馆"],
+    "校史探秘": ["老图书馆", "宋卿体育馆", "十八栋", "郭沫若铜像"],
+    "文化体验": ["万林艺术博物馆", "郭沫若铜像", "樱花大道", "樱顶"],
+    "团日活动": ["老图书馆", "宋卿体育馆", "郭沫若铜像", "工学部操场"],
+    "新生破冰": ["樱花大道", "樱顶", "工学部操场", "万林艺术博物馆"],
+    "社团活动": ["万林艺术博物馆", "十八栋", "宋卿体育馆", "樱花大道"],
+    "户外拓展": ["工学部操场", "十八栋", "樱顶", "老图书馆"],
+    "文化传承": ["郭沫若铜像", "老图书馆", "樱顶", "万林艺术博物馆"]
+}
+
+# 团建定向的统一出发点
+FUN_MODE_START = "30.514438,114.371233"
+
 class LuojiaExplorer:
     def __init__(self):
         self.base_url = "https://nominatim.openstreetmap.org"
@@ -8,14 +331,50 @@ class LuojiaExplorer:
             "center": "30.5390,114.3576",  # 武汉大学精确中心坐标
             "radius": 5000  # 覆盖整个武大校园的半径
         }
+        # 并发的相同请求在同一进程内只计算一次：分别合并整份方案的生成和对OSM/OSRM的上游调用
+        # （多个gunicorn worker之间不共享，每个worker各自合并）
+        self._request_flight = SingleFlight()
+        self._upstream_flight = SingleFlight()
+    
+    def _nominatim_search(self, url):
+        """调用Nominatim搜索接口，并发的相同查询只发出一次请求"""
+        return self._upstream_flight.do(url, self._fetch_nominatim, url)
+    
+    def _fetch_nominatim(self, url):
+        headers = {'User-Agent': 'LuojiaExplorer/1.0'}
+        response = requests.get(url, headers=headers)
+        return response.json()
+    
+    def _fetch_osrm_route(self, osrm_url):
+        """调用OSRM路线接口，失败时返回None"""
+        try:
+            response = requests.get(osrm_url, timeout=5)
+            response.raise_for_status()  # 检查HTTP状态码
+            
+            # 尝试解析JSON响应
+            try:
+                result = response.json()
+                if result["code"] == "Ok":
+                    route = result["routes"][0]
+                    return {
+                        "distance": route["distance"],
+                        "duration": route["duration"],
+                        "steps": route["legs"][0]["steps"],
+                        "geometry": route.get("geometry", "")  # 编码后的polyline
+                    }
+            except json.JSONDecodeError:
+                # 如果JSON解析失败，使用直线距离的1.2倍作为估算
+                pass
+        except (requests.RequestException, json.JSONDecodeError):
+            # 如果API调用失败，使用直线距离的1.2倍作为估算
+            pass
+        return None
     
     def check_in_campus(self, location):
         """检查地点是否在武大校园范围内"""
         # 使用OSM Nominatim API获取坐标
         geocode_url = f"{self.base_url}/search?q={location}&format=json&limit=1"
-        headers = {'User-Agent': 'LuojiaExplorer/1.0'}
-        response = requests.get(geocode_url, headers=headers)
-        result = response.json()
+        result = self._nominatim_search(geocode_url)
         
         if result:
             # 检查地址中是否包含武汉大学相关信息
@@ -46,28 +405,11 @@ class LuojiaExplorer:
         else:
             dest_lat, dest_lon = destination["lat"], destination["lng"]
         
-        # 使用OSRM API获取路线信息，添加超时和错误处理
-        try:
-            osrm_url = f"http://router.project-osrm.org/route/v1/walking/{origin_lon},{origin_lat};{dest_lon},{dest_lat}?steps=true&geometries=polyline&overview=full"
-            response = requests.get(osrm_url, timeout=5)
-            response.raise_for_status()  # 检查HTTP状态码
-            
-            # 尝试解析JSON响应
-            try:
-                result = response.json()
-                if result["code"] == "Ok":
-                    route = result["routes"][0]
-                    return {
-                        "distance": route["distance"],
-                        "duration": route["duration"],
-                        "steps": route["legs"][0]["steps"]
-                    }
-            except json.JSONDecodeError:
-                # 如果JSON解析失败，使用直线距离的1.2倍作为估算
-                pass
-        except (requests.RequestException, json.JSONDecodeError):
-            # 如果API调用失败，使用直线距离的1.2倍作为估算
-            pass
+        # 使用OSRM API获取路线信息，并发的相同路段只请求一次
+        osrm_url = f"http://router.project-osrm.org/route/v1/walking/{origin_lon},{origin_lat};{dest_lon},{dest_lat}?steps=true&geometries=polyline&overview=full"
+        route = self._upstream_flight.do(osrm_url, self._fetch_osrm_route, osrm_url)
+        if route:
+            return route
         
         # 计算直线距离并返回估算值
         straight_dist = ((dest_lat - origin_lat)*111320)**2 + ((dest_lon - origin_lon)*111320*0.7)**2
@@ -92,9 +434,7 @@ class LuojiaExplorer:
         # 构造查询，确保只获取武汉大学内的POI
         query = f"武汉大学 {tags}" if tags else "武汉大学"
         poi_url = f"{self.base_url}/search?q={query}&format=json&limit=20&viewbox={lon-radius/111320},{lat-radius/111320},{lon+radius/111320},{lat+radius/111320}&bounded=1"
-        headers = {'User-Agent': 'LuojiaExplorer/1.0'}
-        response = requests.get(poi_url, headers=headers)
-        result = response.json()
+        result = self._nominatim_search(poi_url)
         
         # 过滤出武汉大学内的POI
         filtered_poi = []
@@ -107,122 +447,8 @@ class LuojiaExplorer:
                 })
         return filtered_poi
     
-    def professional_mode(self, race_type, start, end):
-        """专业赛事编排模式 - 符合IOF 2024标准"""
-        # 武大校内预设控制点，包含更多详细信息
-        preset_control_points = [
-            {
-                "name": "CP1-信息学部操场",
-                "code": "1",
-                "location": {"lat": 30.5300, "lng": 114.3557},
-                "address": "武汉大学信息学部",
-                "elevation": 30,
-                "difficulty": 1
-            },
-            {
-                "name": "CP2-文理学部操场",
-                "code": "2",
-                "location": {"lat": 30.5370, "lng": 114.3600},
-                "address": "武汉大学文理学部",
-                "elevation": 28,
-                "difficulty": 1
-            },
-            {
-                "name": "CP3-万林艺术博物馆",
-                "code": "3",
-                "location": {"lat": 30.5390, "lng": 114.3576},
-                "address": "武汉大学文理学部",
-                "elevation": 32,
-                "difficulty": 1
-            },
-            {
-                "name": "CP4-老图书馆",
-                "code": "4",
-                "location": {"lat": 30.5380, "lng": 114.3610},
-                "address": "武汉大学樱顶",
-                "elevation": 45,
-                "difficulty": 2
-            },
-            {
-                "name": "CP5-信息学部图书馆",
-                "code": "5",
-                "location": {"lat": 30.5314, "lng": 114.3557},
-                "address": "武汉大学信息学部",
-                "elevation": 35,
-                "difficulty": 2
-            },
-            {
-                "name": "CP6-医学部",
-                "code": "6",
-                "location": {"lat": 30.5566, "lng": 114.3505},
-                "address": "武汉大学医学部",
-                "elevation": 22,
-                "difficulty": 1
-            },
-            {
-                "name": "CP7-工学部",
-                "code": "7",
-                "location": {"lat": 30.5450, "lng": 114.3650},
-                "address": "武汉大学工学部",
-                "elevation": 25,
-                "difficulty": 1
-            },
-            {
-                "name": "CP8-樱花大道",
-                "code": "8",
-                "location": {"lat": 30.5385, "lng": 114.3620},
-                "address": "武汉大学文理学部",
-                "elevation": 40,
-                "difficulty": 2
-            },
-            {
-                "name": "CP9-宋卿体育馆",
-                "code": "9",
-                "location": {"lat": 30.5375, "lng": 114.3630},
-                "address": "武汉大学文理学部",
-                "elevation": 35,
-                "difficulty": 2
-            },
-            {
-                "name": "CP10-十八栋",
-                "code": "10",
-                "location": {"lat": 30.5395, "lng": 114.3640},
-                "address": "武汉大学珞珈山",
-                "elevation": 50,
-                "difficulty": 3
-            }
-        ]
-        
-        # 赛事类型参数配置（IOF标准）
-        race_config = {
-            "短距离": {
-                "name": "Sprint",
-                "control_points": 6-8,
-                "total_distance": 2.5-3.5,  # km
-                "max_climb": 100,  # m
-                "description": "短距离赛，注重技术和路线选择"
-            },
-            "百米定向": {
-                "name": "Park Sprint",
-                "control_points": 3-5,
-                "total_distance": 0.3-0.5,  # km
-                "max_climb": 20,  # m
-                "description": "百米定向，密集控制点，快速决策"
-            },
-            "积分赛": {
-                "name": "Score Orienteering",
-                "control_points": 10-15,
-                "total_distance": 4-6,  # km
-                "max_climb": 150,  # m
-                "description": "积分赛，自由选择路线，按完成时间和积分计算"
-            }
-        }
-        
-        if race_type not in race_config:
-            return "错误：不支持的赛事类型！请尝试：短距离、百米定向、积分赛"
-        
-        config = race_config[race_type]
-        
+    def build_professional_course(self, race_type, start, end):
+        """生成专业赛事路线模型（含起点、控制点和终点）"""
         # 检查起点终点是否在校园内（简化检查）
         start_loc = {"lat": 30.5300, "lng": 114.3557}  # 信息学部操场
         end_loc = {"lat": 30.5370, "lng": 114.3600}  # 文理学部操场
@@ -234,72 +460,45 @@ class LuojiaExplorer:
         
         # 根据赛事类型选择控制点
         if race_type == "短距离":
-            full_route.extend(preset_control_points[:6])
+            full_route.extend(PRESET_CONTROL_POINTS[:6])
         elif race_type == "百米定向":
             # 百米定向选择距离起点较近的控制点
-            full_route.extend(preset_control_points[:4])
+            full_route.extend(PRESET_CONTROL_POINTS[:4])
         elif race_type == "积分赛":
             # 积分赛选择更多分散的控制点
-            full_route.extend(preset_control_points)
+            full_route.extend(PRESET_CONTROL_POINTS)
         
         full_route.append({"name": f"终点({end})", "location": end_loc, "elevation": 28, "code": "F"})
         
-        # 计算路线详细信息
-        total_distance = 0
-        total_climb = 0
-        total_straight_distance = 0
-        segments = []
-        
-        for i in range(len(full_route) - 1):
-            current = full_route[i]
-            next_point = full_route[i+1]
-            
-            # 计算直线距离（米）
-            lat1, lon1 = current["location"]["lat"], current["location"]["lng"]
-            lat2, lon2 = next_point["location"]["lat"], next_point["location"]["lng"]
-            
-            # 简单的直线距离计算（Haversine公式简化）
-            straight_dist = ((lat2 - lat1)*111320)**2 + ((lon2 - lon1)*111320*0.7)**2
-            straight_dist = straight_dist**0.5
-            total_straight_distance += straight_dist
-            
-            # 获取实际路线距离
-            route = self.get_route(f"{lat1},{lon1}", f"{lat2},{lon2}")
-            if route:
-                actual_dist = route["distance"]
-                total_distance += actual_dist
-                
-                # 计算爬升
-                climb = max(0, next_point["elevation"] - current["elevation"])
-                total_climb += climb
-                
-                segments.append({
-                    "from": current["code"],
-                    "to": next_point["code"],
-                    "straight_distance": straight_dist,
-                    "actual_distance": actual_dist,
-                    "climb": climb,
-                    "from_name": current["name"],
-                    "to_name": next_point["name"]
-                })
+        meta = {"mode": "professional", "race_type": race_type, "start": start, "end": end}
+        return Course(full_route, self.get_route, meta)
+    
+    def professional_mode(self, race_type, start, end):
+        """专业赛事编排模式 - 符合IOF 2024标准"""
+        if race_type not in RACE_CONFIG:
+            return "错误：不支持的赛事类型！请尝试：短距离、百米定向、积分赛"
         
-        # 计算路线选择比率（Route Choice Ratio）
-        route_choice_ratio = total_distance / total_straight_distance if total_straight_distance > 0 else 1.0
+        course = self.build_professional_course(race_type, start, end)
+        return self.format_professional_report(race_type, start, end, course)
+    
+    def format_professional_report(self, race_type, start, end, course):
+        """根据路线模型生成专业赛事报告，路线修改后可直接重新生成"""
+        config = RACE_CONFIG[race_type]
         
         # 生成专业赛事报告
         result = f"🏆 【IOF标准】{race_type}赛事路线报告 🏆\n"
         result += f"📋 赛事信息：{config['name']} | {config['description']}\n"
         result += f"📍 起点：{start} | 终点：{end}\n"
         result += f"📏 路线数据：\n"
-        result += f"   • 总实际距离：{total_distance/1000:.2f} km\n"
-        result += f"   • 总直线距离：{total_straight_distance/1000:.2f} km\n"
-        result += f"   • 路线选择比率：{route_choice_ratio:.2f}（IOF推荐值：1.2-1.5）\n"
-        result += f"   • 总爬升高度：{total_climb} m\n"
-        result += f"   • 控制点数量：{len(full_route)-2} 个\n"
-        result += f"   • 赛段数量：{len(segments)} 个\n\n"
+        result += f"   • 总实际距离：{course.total_distance/1000:.2f} km\n"
+        result += f"   • 总直线距离：{course.total_straight_distance/1000:.2f} km\n"
+        result += f"   • 路线选择比率：{course.route_choice_ratio:.2f}（IOF推荐值：1.2-1.5）\n"
+        result += f"   • 总爬升高度：{course.total_climb} m\n"
+        result += f"   • 控制点数量：{course.control_points} 个\n"
+        result += f"   • 赛段数量：{len(course.legs)} 个\n\n"
         
         result += f"🔢 路线详情（按IOF标准）：\n"
-        for i, segment in enumerate(segments):
+        for i, segment in enumerate(course.legs):
             from_code = segment["from"]
             to_code = segment["to"]
             from_name = segment["from_name"]
@@ -344,14 +543,14 @@ class LuojiaExplorer:
             result += "   • 需设定关门时间，建议60-90分钟\n"
         
         result += f"\n📊 赛事难度评估：\n"
-        if total_climb > config['max_climb']:
+        if course.total_climb > config['max_climb']:
             result += f"   • 爬升难度：高（超出IOF推荐值）\n"
         else:
             result += f"   • 爬升难度：适中（符合IOF推荐值）\n"
         
-        if route_choice_ratio > 1.5:
+        if course.route_choice_ratio > 1.5:
             result += f"   • 路线选择难度：高\n"
-        elif route_choice_ratio < 1.2:
+        elif course.route_choice_ratio < 1.2:
             result += f"   • 路线选择难度：低\n"
         else:
             result += f"   • 路线选择难度：适中（符合IOF推荐值）\n"
@@ -360,219 +559,31 @@ class LuojiaExplorer:
         
         return result
     
+    def build_fun_course(self, theme):
+        """生成团建定向路线模型：从出发点依次前往主题点位，每个点位带有任务"""
+        full_route = [{"name": "出发点", "location": FUN_MODE_START, "code": "S"}]
+        for i, poi_key in enumerate(THEME_POI_MAP[theme], 1):
+            poi = WUHAN_UNIVERSITY_POI[poi_key]
+            full_route.append({
+                "name": poi["name"],
+                "code": str(i),
+                "location": poi["location"],
+                "clue": poi["clue"],
+                "address": poi["address"],
+                "tasks": poi["tasks"]
+            })
+        return Course(full_route, self.get_route, {"mode": "fun", "theme": theme})
+    
     def fun_mode(self, theme):
         """团建趣味定向模式 - 增强版"""
-        # 武大校内著名POI列表，包含详细的团建任务
-        wuhan_university_poi = {
-            "樱花大道": {
-                "name": "武汉大学樱花大道",
-                "location": "30.5385,114.3620",
-                "clue": "寻找校园里最浪漫的花路，每年三月这里会变成粉色海洋。",
-                "address": "武汉大学文理学部",
-                "tasks": [
-                    {
-                        "name": "樱花创意合影",
-                        "description": "团队全员参与，在樱花树下拍摄一张创意合影，必须包含樱花元素。",
-                        "type": "拍照任务",
-                        "difficulty": "简单",
-                        "points": 10,
-                        "time_limit": 5  # 分钟
-                    },
-                    {
-                        "name": "樱花诗词接龙",
-                        "description": "团队成员轮流说出带有'樱'或'花'字的诗词，至少完成5句。",
-                        "type": "知识挑战",
-                        "difficulty": "中等",
-                        "points": 15,
-                        "time_limit": 3  # 分钟
-                    }
-                ]
-            },
-            "樱顶": {
-                "name": "武汉大学樱顶",
-                "location": "30.5380,114.3610",
-                "clue": "寻找樱花盛开时的最佳观赏点，俯瞰整个武大校园。",
-                "address": "武汉大学老图书馆旁",
-                "tasks": [
-                    {
-                        "name": "校训解密",
-                        "description": "找到樱顶校训碑，集体朗读校训，并解释其含义。",
-                        "type": "知识问答",
-                        "difficulty": "简单",
-                        "points": 10,
-                        "time_limit": 4  # 分钟
-                    },
-                    {
-                        "name": "校园俯瞰拼图",
-                        "description": "从樱顶俯瞰校园，用手机拍摄3张不同角度的照片，拼成一张完整的校园全景图。",
-                        "type": "创意挑战",
-                        "difficulty": "中等",
-                        "points": 20,
-                        "time_limit": 6  # 分钟
-                    }
-                ]
-            },
-            "老图书馆": {
-                "name": "武汉大学老图书馆",
-                "location": "30.5380,114.3610",
-                "clue": "寻找最高学府的最高点，这里见证了武大的百年历史。",
-                "address": "武汉大学樱顶",
-                "tasks": [
-                    {
-                        "name": "身体拼字",
-                        "description": "团队成员用身体拼出'武大'或'珞珈'两个字，拍摄视频记录。",
-                        "type": "团队协作",
-                        "difficulty": "中等",
-                        "points": 15,
-                        "time_limit": 5  # 分钟
-                    },
-                    {
-                        "name": "历史问答",
-                        "description": "找出老图书馆的建造年份和建筑师。",
-                        "type": "知识挑战",
-                        "difficulty": "困难",
-                        "points": 25,
-                        "time_limit": 5  # 分钟
-                    }
-                ]
-            },
-            "宋卿体育馆": {
-                "name": "武汉大学宋卿体育馆",
-                "location": "30.5375,114.3630",
-                "clue": "寻找以民国大总统命名的体育馆，它曾是远东最好的体育馆之一。",
-                "address": "武汉大学文理学部",
-                "tasks": [
-                    {
-                        "name": "两人三足挑战",
-                        "description": "团队成员两两一组，完成20米的两人三足比赛，记录最快完成时间。",
-                        "type": "运动挑战",
-                        "difficulty": "中等",
-                        "points": 20,
-                        "time_limit": 8  # 分钟
-                    },
-                    {
-                        "name": "篮球投篮比赛",
-                        "description": "团队成员轮流投篮，在3分钟内投进最多球的团队获胜。",
-                        "type": "运动挑战",
-                        "difficulty": "简单",
-                        "points": 15,
-                        "time_limit": 5  # 分钟
-                    }
-                ]
-            },
-            "十八栋": {
-                "name": "武汉大学十八栋",
-                "location": "30.5395,114.3640",
-                "clue": "寻找民国时期教授们的居所，感受老武大的人文气息。",
-                "address": "武汉大学珞珈山",
-                "tasks": [
-                    {
-                        "name": "老建筑探索",
-                        "description": "找到一栋标有编号的老别墅，记录其编号、建筑风格特点和曾居住的名人。",
-                        "type": "探索任务",
-                        "difficulty": "困难",
-                        "points": 30,
-                        "time_limit": 10  # 分钟
-                    },
-                    {
-                        "name": "自然寻宝",
-                        "description": "在十八栋附近寻找5种不同的植物或动物，拍摄照片并记录名称。",
-                        "type": "探索任务",
-                        "difficulty": "中等",
-                        "points": 20,
-                        "time_limit": 8  # 分钟
-                    }
-                ]
-            },
-            "万林艺术博物馆": {
-                "name": "武汉大学万林艺术博物馆",
-                "location": "30.5390,114.3576",
-                "clue": "寻找校园里最现代的建筑，它的外形像一块飞来的石头。",
-                "address": "武汉大学文理学部",
-                "tasks": [
-                    {
-                        "name": "传统与现代对比",
-                        "description": "以'传统与现代'为主题，拍摄一张万林博物馆与武大老建筑的对比照片。",
-                        "type": "拍照任务",
-                        "difficulty": "中等",
-                        "points": 20,
-                        "time_limit": 6  # 分钟
-                    },
-                    {
-                        "name": "建筑创意素描",
-                        "description": "团队成员合作，用10分钟时间素描万林博物馆的外观，要求包含主要建筑特征。",
-                        "type": "创意挑战",
-                        "difficulty": "困难",
-                        "points": 25,
-                        "time_limit": 10  # 分钟
-                    }
-                ]
-            },
-            "郭沫若铜像": {
-                "name": "武汉大学郭沫若铜像",
-                "location": "30.5370,114.3600",
-                "clue": "寻找著名文学家郭沫若先生的铜像，他曾担任武大校长。",
-                "address": "武汉大学文理学部",
-                "tasks": [
-                    {
-                        "name": "即兴短剧表演",
-                        "description": "围绕郭沫若的文学作品或生平事迹，即兴表演一个1-2分钟的短剧。",
-                        "type": "创意表演",
-                        "difficulty": "中等",
-                        "points": 25,
-                        "time_limit": 10  # 分钟
-                    },
-                    {
-                        "name": "诗歌朗诵",
-                        "description": "团队成员集体朗诵一首郭沫若的诗歌，要求有感情地背诵。",
-                        "type": "文化体验",
-                        "difficulty": "简单",
-                        "points": 15,
-                        "time_limit": 5  # 分钟
-                    }
-                ]
-            },
-            "工学部操场": {
-                "name": "武汉大学工学部操场",
-                "location": "30.5450,114.3650",
-                "clue": "寻找工学部的运动天地，这里是工科学子挥洒汗水的地方。",
-                "address": "武汉大学工学部",
-                "tasks": [
-                    {
-                        "name": "拔河比赛",
-                        "description": "与其他团队进行一场5分钟的拔河比赛，获胜团队获得双倍积分。",
-                        "type": "团队游戏",
-                        "difficulty": "中等",
-                        "points": 30,
-                        "time_limit": 10  # 分钟
-                    },
-                    {
-                        "name": "接力赛跑",
-                        "description": "团队成员进行4x100米接力赛，记录完成时间。",
-                        "type": "运动挑战",
-                        "difficulty": "中等",
-                        "points": 25,
-                        "time_limit": 8  # 分钟
-                    }
-                ]
-            }
-        }
-        
-        # 团建主题任务映射
-        theme_poi_map = {
-            "樱花季": ["樱花大道", "樱顶", "老图书馆", "万林艺术博物馆"],
-            "校史探秘": ["老图书馆", "宋卿体育馆", "十八栋", "郭沫若铜像"],
-            "文化体验": ["万林艺术博物馆", "郭沫若铜像", "樱花大道", "樱顶"],
-            "团日活动": ["老图书馆", "宋卿体育馆", "郭沫若铜像", "工学部操场"],
-            "新生破冰": ["樱花大道", "樱顶", "工学部操场", "万林艺术博物馆"],
-            "社团活动": ["万林艺术博物馆", "十八栋", "宋卿体育馆", "樱花大道"],
-            "户外拓展": ["工学部操场", "十八栋", "樱顶", "老图书馆"],
-            "文化传承": ["郭沫若铜像", "老图书馆", "樱顶", "万林艺术博物馆"]
-        }
-        
-        if theme not in theme_poi_map:
+        if theme not in THEME_POI_MAP:
             return "错误：不支持的活动主题！请尝试：樱花季、校史探秘、文化体验、团日活动、新生破冰、社团活动、户外拓展、文化传承"
         
+        course = self.build_fun_course(theme)
+        return self.format_fun_report(theme, course)
+    
+    def format_fun_report(self, theme, course):
+        """根据路线模型生成团建方案，点位或任务修改后可直接重新生成"""
         # 生成团建任务方案
         result = f"🎉 【{theme}】团建定向方案 🎉\n"
         result += "📋 活动规则：\n"
@@ -590,40 +601,34 @@ class LuojiaExplorer:
         result += "• 最佳创意团队额外奖励15分\n\n"
         
         total_duration = 0
-        total_points = 0
-        selected_points = theme_poi_map[theme]
         
-        for i, poi_key in enumerate(selected_points, 1):
-            if poi_key in wuhan_university_poi:
-                poi = wuhan_university_poi[poi_key]
-                # 获取导航信息
-                route = self.get_route("30.514438,114.371233", poi["location"])
-                duration = int(route["duration"]/60) if route else 5
-                total_duration += duration
-                
-                result += f"📍 点位{i}：{poi['name']}\n"
-                result += f"🔍 LBS线索：{poi['clue']}\n"
-                result += f"🧭 导航指引：打开地图导航至{poi['name']}，步行约{duration}分钟，注意{poi['address']}周边地形\n"
-                result += f"⏱️  建议用时：{duration+10}分钟\n"
-                result += f"📌 点位介绍：{poi['name']}是武汉大学的著名地标，具有丰富的历史和文化内涵。\n"
-                
-                # 输出任务列表
-                for j, task in enumerate(poi['tasks']):
-                    result += f"\n   📝 任务{j+1}（{task['difficulty']}）：{task['name']}\n"
-                    result += f"      • 类型：{task['type']}\n"
-                    result += f"      • 描述：{task['description']}\n"
-                    result += f"      • 分值：{task['points']}分\n"
-                    result += f"      • 时间限制：{task['time_limit']}分钟\n"
-                    total_points += task['points']
-                
-                result += "\n"
+        # 路线从出发点依次经过各点位，每个点位的步行时间取到达它的赛段
+        for i, (poi, leg) in enumerate(zip(course.points[1:], course.legs), 1):
+            duration = int(leg["duration"]/60)
+            total_duration += duration
+            
+            result += f"📍 点位{i}：{poi['name']}\n"
+            result += f"🔍 LBS线索：{poi['clue']}\n"
+            result += f"🧭 导航指引：打开地图导航至{poi['name']}，步行约{duration}分钟，注意{poi['address']}周边地形\n"
+            result += f"⏱️  建议用时：{duration+10}分钟\n"
+            result += f"📌 点位介绍：{poi['name']}是武汉大学的著名地标，具有丰富的历史和文化内涵。\n"
+            
+            # 输出任务列表
+            for j, task in enumerate(poi['tasks']):
+                result += f"\n   📝 任务{j+1}（{task['difficulty']}）：{task['name']}\n"
+                result += f"      • 类型：{task['type']}\n"
+                result += f"      • 描述：{task['description']}\n"
+                result += f"      • 分值：{task['points']}分\n"
+                result += f"      • 时间限制：{task['time_limit']}分钟\n"
+            
+            result += "\n"
         
         result += f"📊 方案概览：\n"
-        result += f"• 总点位数量：{len(selected_points)}个\n"
-        result += f"• 总任务数量：{sum(len(poi['tasks']) for poi in wuhan_university_poi.values() if poi['name'].split('·')[-1] in [p.split('·')[-1] for p in selected_points])}\n"
-        result += f"• 最高可获积分：{total_points}分\n"
+        result += f"• 总点位数量：{len(course.points)-1}个\n"
+        result += f"• 总任务数量：{course.total_tasks}\n"
+        result += f"• 最高可获积分：{course.total_points}分\n"
         result += f"• 预计总时长：约{total_duration+40}分钟\n"
-        result += f"• 总步行距离：约{int(total_duration*80)}米（估算）\n\n"
+        result += f"• 总步行距离：约{int(course.total_distance)}米\n\n"
         
         result += f"🤝 团建建议：\n"
         result += "1. 活动前：确保所有队员穿着舒适的运动鞋和服装，携带手机和充电宝\n"
@@ -652,11 +657,13 @@ class LuojiaExplorer:
     def process_request(self, user_input):
         """处理用户请求"""
         # 意图识别
+        # 以识别出的模式和参数作为合并依据，措辞不同但结果相同的并发请求也只计算一次
         if any(word in user_input for word in ["比赛", "专业", "赛事", "短距离", "百米定向", "积分赛"]):
             # 专业模式
             # 解析输入：赛事类型、起点、终点
             # 这里简化处理，实际需要更复杂的NLP解析
-            return self.professional_mode("短距离", "武汉大学信息学部操场", "武汉大学文理学部操场")
+            args = ("短距离", "武汉大学信息学部操场", "武汉大学文理学部操场")
+            return self._request_flight.do(("professional",) + args, self.professional_mode, *args)
         else:
             # 趣味模式
             # 解析主题
@@ -666,7 +673,7 @@ class LuojiaExplorer:
                 theme = "校史探秘"
             else:
                 theme = "文化体验"
-            return self.fun_mode(theme)
+            return self._request_flight.do(("fun", theme), self.fun_mode, theme)
 
 # 测试代码
 if __name__ == "__main__":
@@ -0,0 +1,228 @@
+import copy
+import json
+import os
+import time
+
+from storage import atomic_write_json
+
+
+def parse_location(location):
+    """把 "纬度,经度" 字符串或 {"lat", "lng"} 字典统一为字典"""
+    if isinstance(location, str):
+        lat, lng = map(float, location.split(','))
+        return {"lat": lat, "lng": lng}
+    return {"lat": float(location["lat"]), "lng": float(location["lng"])}
+
+
+def decode_polyline(encoded, precision=5):
+    """解码OSRM返回的polyline字符串，返回 [[纬度, 经度], ...]"""
+    coordinates = []
+    index = lat = lng = 0
+    factor = 10 ** precision
+    while index < len(encoded):
+        values = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            values.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += values[0]
+        lng += values[1]
+        coordinates.append([lat / factor, lng / factor])
+    return coordinates
+
+
+def straight_distance(origin, destination):
+    """两点之间的直线距离（米，与professional_mode相同的简化公式）"""
+    dist = ((destination["lat"] - origin["lat"])*111320)**2 + ((destination["lng"] - origin["lng"])*111320*0.7)**2
+    return dist**0.5
+
+
+class Course:
+    """定向路线模型
+
+    维护点位 -> 赛段 -> 汇总指标的依赖关系：移动一个点位只重新规划与它相邻的两个赛段，
+    总距离、总爬升、积分等汇总值按新旧赛段的差值增量更新，不再重新生成整条路线。
+    实例本身不加锁：接口每次请求都从磁盘读取自己的Course，并发修改由app.course_lock串行化。
+    """
+    def __init__(self, points, route_fn, meta=None, routes=None):
+        """points: 按顺序排列的点位（含起点和终点）；route_fn: 路线规划函数，如LuojiaExplorer.get_route
+        meta: 生成路线时的参数（模式、赛事类型/主题等）
+        routes: 已保存的各赛段路线，提供时直接复用，不再调用route_fn"""
+        self.route_fn = route_fn
+        self.meta = dict(meta or {})
+        self.points = []
+        for point in points:
+            point = copy.deepcopy(point)
+            point["location"] = parse_location(point["location"])
+            point.setdefault("elevation", 0)
+            point.setdefault("tasks", [])
+            self.points.append(point)
+
+        self.total_distance = 0
+        self.total_straight_distance = 0
+        self.total_climb = 0
+        self.total_duration = 0
+        self.total_points = sum(task["points"] for point in self.points for task in point["tasks"])
+        self.total_tasks = sum(len(point["tasks"]) for point in self.points)
+
+        self.legs = []
+        for i in range(len(self.points) - 1):
+            leg = self._compute_leg(i, routes[i] if routes else None)
+            self.legs.append(leg)
+            self._apply_leg(leg, 1)
+
+    @property
+    def route_choice_ratio(self):
+        """路线选择比率（Route Choice Ratio）"""
+        return self.total_distance / self.total_straight_distance if self.total_straight_distance > 0 else 1.0
+
+    @property
+    def control_points(self):
+        """控制点数量（不含起点和终点）"""
+        return max(0, len(self.points) - 2)
+
+    def _compute_leg(self, i, route=None):
+        """计算第i个赛段（points[i] -> points[i+1]），route为None时重新规划路线"""
+        current = self.points[i]
+        next_point = self.points[i+1]
+        if route is None:
+            route = self.route_fn(current["location"], next_point["location"])
+        return {
+            "from": current["code"],
+            "to": next_point["code"],
+            "straight_distance": straight_distance(current["location"], next_point["location"]),
+            "actual_distance": route["distance"],
+            "duration": route["duration"],
+            "climb": max(0, next_point["elevation"] - current["elevation"]),
+            "from_name": current["name"],
+            "to_name": next_point["name"],
+            "route": route
+        }
+
+    def leg_coordinates(self, i):
+        """第i个赛段的路线坐标，没有路线几何信息时退化为两点直线"""
+        geometry = self.legs[i]["route"].get("geometry")
+        if geometry:
+            return decode_polyline(geometry)
+        return [[point["location"]["lat"], point["location"]["lng"]] for point in self.points[i:i+2]]
+
+    def _apply_leg(self, leg, sign):
+        """把赛段计入（sign=1）或移出（sign=-1）汇总值"""
+        self.total_distance += sign * leg["actual_distance"]
+        self.total_straight_distance += sign * leg["straight_distance"]
+        self.total_climb += sign * leg["climb"]
+        self.total_duration += sign * leg["duration"]
+
+    def _replace_leg(self, i, reroute=True):
+        old = self.legs[i]
+        new = self._compute_leg(i, None if reroute else old["route"])
+        self._apply_leg(old, -1)
+        self._apply_leg(new, 1)
+        self.legs[i] = new
+
+    def _adjacent_legs(self, index):
+        return [i for i in (index - 1, index) if 0 <= i < len(self.legs)]
+
+    def move_point(self, index, location, elevation=None):
+        """移动点位，只重新规划相邻的两个赛段，返回受影响的赛段下标"""
+        point = self.points[index]
+        point["location"] = parse_location(location)
+        if elevation is not None:
+            point["elevation"] = elevation
+        changed = self._adjacent_legs(index)
+        for i in changed:
+            self._replace_leg(i)
+        return changed
+
+    def set_elevation(self, index, elevation):
+        """修改点位海拔，只更新相邻赛段的爬升，不重新规划路线"""
+        self.points[index]["elevation"] = elevation
+        changed = self._adjacent_legs(index)
+        for i in changed:
+            self._replace_leg(i, reroute=False)
+        return changed
+
+    def update_task(self, index, task_index, **changes):
+        """修改点位上的一个任务，积分总数按差值更新"""
+        task = self.points[index]["tasks"][task_index]
+        self.total_points -= task["points"]
+        task.update(changes)
+        self.total_points += task["points"]
+        return task
+
+    def to_dict(self):
+        """可序列化的路线数据，用于保存到磁盘，不含路线步骤"""
+        return {
+            "meta": dict(self.meta),
+            "points": copy.deepcopy(self.points),
+            "routes": [{k: v for k, v in leg["route"].items() if k != "steps"} for leg in self.legs]
+        }
+
+    def summary(self):
+        """路线概览，供接口返回"""
+        return {
+            "meta": dict(self.meta),
+            "points": copy.deepcopy(self.points),
+            "legs": [{k: v for k, v in leg.items() if k != "route"} for leg in self.legs],
+            "total_distance": self.total_distance,
+            "total_straight_distance": self.total_straight_distance,
+            "route_choice_ratio": self.route_choice_ratio,
+            "total_climb": self.total_climb,
+            "total_duration": self.total_duration,
+            "control_points": self.control_points,
+            "total_points": self.total_points,
+            "total_tasks": self.total_tasks
+        }
+
+
+def course_path(store_dir, course_id):
+    return os.path.join(store_dir, course_id + '.json')
+
+
+def save_course(store_dir, course_id, course):
+    """把路线保存到磁盘，多个worker进程之间共享"""
+    atomic_write_json(course_path(store_dir, course_id), course.to_dict())
+
+
+def load_course(store_dir, course_id, route_fn):
+    """从磁盘还原路线，复用已保存的赛段路线；路线不存在时返回None"""
+    try:
+        with open(course_path(store_dir, course_id), encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    return Course(data["points"], route_fn, data["meta"], data["routes"])
+
+
+def delete_course(store_dir, course_id):
+    """删除保存的路线，返回是否存在"""
+    try:
+        os.remove(course_path(store_dir, course_id))
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def evict_courses(store_dir, max_age):
+    """删除超过max_age秒未修改的路线，返回被删除的course_id"""
+    if not os.path.isdir(store_dir):
+        return []
+    now = time.time()
+    evicted = []
+    for name in os.listdir(store_dir):
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(store_dir, name)
+        try:
+            if now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+                evicted.append(name[:-len('.json')])
+        except FileNotFoundError:
+            continue
+    return evicted
@@ -0,0 +1,219 @@
+import argparse
+
+import numpy as np
+
+from campus_orientation import LuojiaExplorer, WUHAN_UNIVERSITY_POI, THEME_POI_MAP, FUN_MODE_START
+
+
+def build_walk_matrix(explorer, locations):
+    """用路线服务计算各地点之间的步行时间矩阵（分钟）"""
+    n = len(locations)
+    minutes = np.zeros((n, n))
+    for i in range(n):
+        for j in range(i + 1, n):
+            route = explorer.get_route(locations[i], locations[j])
+            minutes[i, j] = minutes[j, i] = route["duration"] / 60
+    return minutes
+
+
+def simulate(orders, walk_minutes, service_minutes, n_replications=2000, stagger=0.0,
+             capacity=1, walk_noise=0.15, service_spread=0.4, seed=None):
+    """蒙特卡洛模拟多支团队在各点位的排队情况
+
+    orders: (团队数, 路线点位数) 每支团队依次前往的点位下标
+    walk_minutes: (点位数+1, 点位数+1) 步行时间矩阵，下标0为出发点
+    service_minutes: (点位数,) 每个点位完成任务的时间上限
+    stagger: 相邻团队的出发间隔（分钟），也可以传入每支团队的出发时间
+    capacity: 每个点位可同时进行任务的团队数，可为标量或 (点位数,) 数组
+
+    所有重复实验在NumPy中并行推进：每一步为每次实验取出最早到达的团队，
+    因此各点位严格按到达先后排队。参数不合法时抛出ValueError。
+    """
+    orders = np.asarray(orders, dtype=int)
+    walk_minutes = np.asarray(walk_minutes, dtype=float)
+    service_minutes = np.asarray(service_minutes, dtype=float)
+    n_poi = len(service_minutes)
+
+    # 结果按 [团队, 点位] 记录，同一团队重复前往同一点位会覆盖之前的数据
+    if orders.ndim != 2 or orders.shape[0] < 1 or orders.shape[1] < 1:
+        raise ValueError("orders需要是 (团队数, 路线点位数) 的二维数组，且至少有一支团队和一个点位")
+    if orders.min() < 0 or orders.max() >= n_poi:
+        raise ValueError("orders中的点位下标超出范围")
+    if (np.diff(np.sort(orders, axis=1), axis=1) == 0).any():
+        raise ValueError("每支团队的路线中不能重复出现同一点位")
+    if walk_minutes.shape != (n_poi + 1, n_poi + 1):
+        raise ValueError("walk_minutes需要是 (点位数+1, 点位数+1) 的矩阵")
+    if n_replications < 1:
+        raise ValueError("n_replications至少为1")
+    n_teams, n_stops = orders.shape
+    rng = np.random.default_rng(seed)
+    rr = np.arange(n_replications)
+
+    if np.ndim(stagger) == 0:
+        start_times = np.arange(n_teams) * float(stagger)
+    else:
+        start_times = np.asarray(stagger, dtype=float)
+        if start_times.shape != (n_teams,):
+            raise ValueError("stagger为数组时需要为每支团队提供出发时间")
+
+    # 每个点位的服务台，容量不足最大值的点位用inf填充多余的服务台
+    capacity = np.broadcast_to(np.asarray(capacity, dtype=int), (n_poi,))
+    if (capacity < 1).any():
+        raise ValueError("capacity至少为1")
+    server_free = np.zeros((n_replications, n_poi, capacity.max()))
+    server_free[:, np.arange(capacity.max())[None, :] >= capacity[:, None]] = np.inf
+
+    # 预先抽样全部随机量：步行时间按对数正态扰动，任务用时在上限的(1-spread)~1倍之间
+    walk_factor = rng.lognormal(0.0, walk_noise, size=(n_replications, n_teams, n_stops))
+    service = service_minutes * rng.uniform(1 - service_spread, 1.0, size=(n_replications, n_teams, n_poi))
+
+    arrival = np.full((n_replications, n_teams, n_poi), np.nan)
+    wait = np.full((n_replications, n_teams, n_poi), np.nan)
+    queue = np.full((n_replications, n_teams, n_poi), np.nan)
+    finish = np.zeros((n_replications, n_teams))
+    # 各团队在各点位开始做任务的时间，用于统计到达时前面还有多少团队在等待
+    started = np.full((n_replications, n_poi, n_teams), -np.inf)
+
+    stage = np.zeros((n_replications, n_teams), dtype=int)
+    next_arrival = start_times + walk_minutes[0, orders[:, 0] + 1] * walk_factor[:, :, 0]
+
+    for _ in range(n_teams * n_stops):
+        team = np.argmin(next_arrival, axis=1)
+        arrive = next_arrival[rr, team]
+        k = stage[rr, team]
+        poi = orders[team, k]
+
+        free = server_free[rr, poi]
+        server = np.argmin(free, axis=1)
+        begin = np.maximum(arrive, free[rr, server])
+        end = begin + service[rr, team, poi]
+
+        queue[rr, team, poi] = (started[rr, poi] > arrive[:, None]).sum(axis=1)
+        arrival[rr, team, poi] = arrive
+        wait[rr, team, poi] = begin - arrive
+        started[rr, poi, team] = begin
+        server_free[rr, poi, server] = end
+
+        last = k + 1 >= n_stops
+        following = orders[team, np.minimum(k + 1, n_stops - 1)]
+        leg = walk_minutes[poi + 1, following + 1] * walk_factor[rr, team, np.minimum(k + 1, n_stops - 1)]
+        next_arrival[rr, team] = np.where(last, np.inf, end + leg)
+        finish[rr, team] = np.where(last, end, finish[rr, team])
+        stage[rr, team] = k + 1
+
+    return {
+        "arrival": arrival,
+        "wait": wait,
+        "queue": queue,
+        "finish": finish,
+        "start": start_times,
+    }
+
+
+def summarize(result, poi_names):
+    """汇总模拟结果：各点位排队长度和等待时间，以及完赛时间分布"""
+    wait, queue, finish = result["wait"], result["queue"], result["finish"]
+    summary = {"teams": finish.shape[1], "replications": finish.shape[0], "poi": []}
+
+    for p, name in enumerate(poi_names):
+        visited = ~np.isnan(wait[:, :, p])
+        if not visited.any():
+            continue
+        waits = wait[:, :, p][visited]
+        queues = queue[:, :, p][visited]
+        peak = np.where(visited, queue[:, :, p], 0).max(axis=1)
+        summary["poi"].append({
+            "name": name,
+            "mean_queue": float(queues.mean()),
+            "peak_queue": float(peak.mean()),
+            "peak_queue_p95": float(np.percentile(peak, 95)),
+            "mean_wait": float(waits.mean()),
+            "wait_p95": float(np.percentile(waits, 95)),
+            "wait_probability": float((waits > 0.5).mean()),
+        })
+
+    elapsed = finish - result["start"]
+    makespan = finish.max(axis=1)
+    summary["team_duration"] = {
+        "mean": float(elapsed.mean()),
+        "p50": float(np.percentile(elapsed, 50)),
+        "p90": float(np.percentile(elapsed, 90)),
+        "max": float(elapsed.max()),
+    }
+    summary["makespan"] = {
+        "mean": float(makespan.mean()),
+        "p50": float(np.percentile(makespan, 50)),
+        "p90": float(np.percentile(makespan, 90)),
+        "p95": float(np.percentile(makespan, 95)),
+    }
+    return summary
+
+
+def simulate_theme(explorer, theme, n_teams, stagger=0.0, rotate=False, **kwargs):
+    """按团建主题模拟：点位、任务时间上限和步行时间均来自fun_mode使用的数据"""
+    if theme not in THEME_POI_MAP:
+        raise ValueError(f"不支持的活动主题：{theme}")
+    pois = [WUHAN_UNIVERSITY_POI[key] for key in THEME_POI_MAP[theme]]
+    locations = [FUN_MODE_START] + [poi["location"] for poi in pois]
+    walk_minutes = build_walk_matrix(explorer, locations)
+    service_minutes = [sum(task["time_limit"] for task in poi["tasks"]) for poi in pois]
+
+    # 默认与fun_mode一致，所有团队按相同顺序前往；rotate时各团队从不同点位出发
+    base = np.arange(len(pois))
+    offsets = np.arange(n_teams)[:, None] if rotate else np.zeros((n_teams, 1), dtype=int)
+    orders = (base[None, :] + offsets) % len(pois)
+
+    result = simulate(orders, walk_minutes, service_minutes, stagger=stagger, **kwargs)
+    summary = summarize(result, [poi["name"] for poi in pois])
+    summary["theme"] = theme
+    summary["stagger"] = stagger
+    summary["rotate"] = rotate
+    return summary
+
+
+def format_report(summary):
+    """生成拥堵预测报告"""
+    result = f"🚦 【{summary.get('theme', '自定义路线')}】拥堵模拟报告 🚦\n"
+    result += f"📋 模拟参数：{summary['teams']}支团队 | {summary['replications']}次蒙特卡洛模拟"
+    if "stagger" in summary:
+        result += f" | 出发间隔{summary['stagger']}分钟 | {'错峰轮换路线' if summary['rotate'] else '统一路线顺序'}"
+    result += "\n\n"
+
+    result += "📍 各点位排队情况：\n"
+    for poi in summary["poi"]:
+        result += f"【{poi['name']}】\n"
+        result += f"   • 到达时平均排队：{poi['mean_queue']:.1f} 支团队\n"
+        result += f"   • 排队峰值：平均{poi['peak_queue']:.1f}支，95%情况下不超过{poi['peak_queue_p95']:.0f}支\n"
+        result += f"   • 平均等待：{poi['mean_wait']:.1f} 分钟（95%分位：{poi['wait_p95']:.1f} 分钟）\n"
+        result += f"   • 需要等待的概率：{poi['wait_probability']*100:.0f}%\n"
+
+    duration, makespan = summary["team_duration"], summary["makespan"]
+    result += f"\n⏱️  完赛时间预测：\n"
+    result += f"   • 单队用时：平均{duration['mean']:.0f}分钟，中位数{duration['p50']:.0f}分钟，90%分位{duration['p90']:.0f}分钟\n"
+    result += f"   • 全部团队完赛：平均{makespan['mean']:.0f}分钟，90%分位{makespan['p90']:.0f}分钟，95%分位{makespan['p95']:.0f}分钟\n"
+    return result
+
+
+def _at_least_one(text):
+    """命令行整数参数，要求不小于1"""
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError("需要为不小于1的整数")
+    return value
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="团建定向点位拥堵与完赛时间模拟")
+    parser.add_argument("theme", help="团建主题，如：樱花季")
+    parser.add_argument("--teams", type=_at_least_one, default=20, help="团队数量")
+    parser.add_argument("--stagger", type=float, default=0.0, help="相邻团队出发间隔（分钟）")
+    parser.add_argument("--rotate", action="store_true", help="各团队从不同点位开始轮换")
+    parser.add_argument("--capacity", type=_at_least_one, default=1, help="每个点位可同时进行任务的团队数")
+    parser.add_argument("--replications", type=_at_least_one, default=2000, help="蒙特卡洛模拟次数")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    summary = simulate_theme(LuojiaExplorer(), args.theme, args.teams, stagger=args.stagger,
+                             rotate=args.rotate, capacity=args.capacity,
+                             n_replications=args.replications, seed=args.seed)
+    print(format_report(summary))
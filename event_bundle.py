@@ -0,0 +1,196 @@
+import argparse
+import base64
+import glob
+import gzip
+import hashlib
+import json
+import math
+import os
+import string
+import time
+
+import requests
+
+from campus_orientation import LuojiaExplorer, RACE_CONFIG, THEME_POI_MAP
+from course_model import load_course
+from storage import atomic_write, atomic_write_json, file_lock
+
+# 瓦片服务地址模板（如 https://tiles.example.com/{z}/{x}/{y}.png），未配置时不打包瓦片。
+# OSM官方瓦片服务器的使用政策禁止批量/离线预取，请使用自建或允许离线使用的瓦片服务。
+TILE_URL = os.environ.get('TILE_URL', '')
+TILE_ATTRIBUTION = os.environ.get('TILE_ATTRIBUTION', '© OpenStreetMap contributors')
+TILE_CACHE_DIR = os.environ.get('TILE_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tile_cache'))
+DEFAULT_ZOOMS = (15, 16, 17)
+MAX_TILES = 400
+BUNDLE_VERSION = 1
+
+
+def lnglat_to_tile(lat, lng, zoom):
+    """经纬度转换为OSM瓦片编号"""
+    n = 2 ** zoom
+    x = int((lng + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return x, y
+
+
+def tiles_for_bounds(bounds, zooms):
+    """覆盖范围 (south, west, north, east) 在各缩放级别下需要的瓦片"""
+    south, west, north, east = bounds
+    ranges = []
+    for z in zooms:
+        x0, y0 = lnglat_to_tile(north, west, z)
+        x1, y1 = lnglat_to_tile(south, east, z)
+        ranges.append((z, x0, x1, y0, y1))
+    # 先检查数量再展开，避免范围过大时生成海量瓦片
+    count = sum((x1 - x0 + 1) * (y1 - y0 + 1) for _, x0, x1, y0, y1 in ranges)
+    if count > MAX_TILES:
+        raise ValueError(f"瓦片数量过多（{count}），请减少缩放级别")
+    return [(z, x, y) for z, x0, x1, y0, y1 in ranges for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+def check_tile_url(tile_url):
+    """检查瓦片地址模板只使用{z}、{x}、{y}三个占位符，否则抛出ValueError"""
+    try:
+        fields = {field for _, field, _, _ in string.Formatter().parse(tile_url) if field is not None}
+    except ValueError:
+        fields = None
+    if fields != {"z", "x", "y"}:
+        raise ValueError(f"瓦片地址模板需要且只能包含{{z}}、{{x}}、{{y}}占位符：{tile_url}")
+
+
+def fetch_tiles(tiles, tile_url, cache_dir=TILE_CACHE_DIR, download=True):
+    """获取地图瓦片，返回 {"z/x/y": base64编码的PNG}，下载失败的瓦片跳过
+
+    瓦片按 瓦片源/z/x/y 缓存在磁盘上，路线修改后重新导出只会下载新增的瓦片。
+    download为False时只读取缓存，不发出网络请求（接口中使用，避免逐个下载瓦片拖住worker）。
+    """
+    check_tile_url(tile_url)
+    source_dir = os.path.join(cache_dir, hashlib.sha1(tile_url.encode('utf-8')).hexdigest()[:12])
+    session = None
+    result = {}
+    for z, x, y in tiles:
+        path = os.path.join(source_dir, str(z), str(x), f"{y}.png")
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                content = f.read()
+        elif not download:
+            continue
+        else:
+            if session is None:
+                session = requests.Session()
+                session.headers['User-Agent'] = 'LuojiaExplorer/1.0'
+            try:
+                response = session.get(tile_url.format(z=z, x=x, y=y), timeout=10)
+                response.raise_for_status()
+            except requests.RequestException:
+                continue
+            content = response.content
+            atomic_write(path, content)
+        result[f"{z}/{x}/{y}"] = base64.b64encode(content).decode('ascii')
+    return result
+
+
+def course_payload(course):
+    """把路线模型整理为手机端需要的数据：点位、线索、任务和赛段路线"""
+    summary = course.summary()
+    points = []
+    for point in summary["points"]:
+        points.append({key: point[key] for key in ("name", "code", "location", "elevation", "clue", "address", "tasks") if key in point})
+    legs = []
+    for i, leg in enumerate(summary["legs"]):
+        leg = dict(leg)
+        leg["coordinates"] = course.leg_coordinates(i)
+        legs.append(leg)
+    totals = {key: summary[key] for key in ("total_distance", "total_straight_distance", "route_choice_ratio",
+                                            "total_climb", "total_duration", "control_points", "total_points", "total_tasks")}
+    return {"meta": summary["meta"], "points": points, "legs": legs, "totals": totals}
+
+
+def course_bounds(payload, padding=0.002):
+    """路线覆盖范围，四周留出少量余量"""
+    coordinates = [coord for leg in payload["legs"] for coord in leg["coordinates"]]
+    coordinates += [[p["location"]["lat"], p["location"]["lng"]] for p in payload["points"]]
+    lats = [c[0] for c in coordinates]
+    lngs = [c[1] for c in coordinates]
+    return min(lats) - padding, min(lngs) - padding, max(lats) + padding, max(lngs) + padding
+
+
+def build_bundle(course, zooms=DEFAULT_ZOOMS, tile_url=None, attribution=TILE_ATTRIBUTION, download_tiles=True):
+    """生成离线活动包，返回 (gzip压缩后的内容, sha256摘要, 缺少的瓦片数)
+
+    tile_url为空时不打包瓦片；download_tiles为False时只打包已缓存的瓦片。
+    内容中不含生成时间，相同的路线和瓦片总是得到相同的摘要，便于按内容做永久缓存。
+    """
+    payload = {"version": BUNDLE_VERSION, "course": course_payload(course), "tiles": {}, "tile_zooms": [],
+               "attribution": attribution}
+    missing = 0
+    if tile_url:
+        tiles = tiles_for_bounds(course_bounds(payload["course"]), zooms)
+        payload["tile_zooms"] = list(zooms)
+        payload["tiles"] = fetch_tiles(tiles, tile_url, download=download_tiles)
+        missing = len(tiles) - len(payload["tiles"])
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return gzip.compress(raw, compresslevel=9, mtime=0), hashlib.sha256(raw).hexdigest(), missing
+
+
+def export_bundle(course, out_dir, zooms=DEFAULT_ZOOMS, tile_url=None, attribution=TILE_ATTRIBUTION, download_tiles=True):
+    """导出离线活动包和manifest.json到out_dir，返回manifest
+
+    活动包文件名包含内容摘要，内容不变即可永久缓存；manifest.json每次导出都会更新，
+    其中assets为相对manifest的路径，可直接交给Service Worker预缓存。
+    manifest不再引用的旧活动包会被删除。missing_tiles为未能打包的瓦片数。
+    """
+    data, digest, missing = build_bundle(course, zooms, tile_url, attribution, download_tiles)
+    filename = f"bundle-{digest[:16]}.json.gz"
+    manifest = {
+        "version": digest[:16],
+        "sha256": digest,
+        "bundle": filename,
+        "size": len(data),
+        "meta": course.meta,
+        "attribution": attribution,
+        "missing_tiles": missing,
+        "created": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "assets": [filename]
+    }
+
+    # 同一路线的并发导出依次写入活动包、manifest并清理旧文件，避免删掉另一次导出刚引用的活动包
+    os.makedirs(out_dir, exist_ok=True)
+    with file_lock(os.path.join(out_dir, '.lock')):
+        path = os.path.join(out_dir, filename)
+        if not os.path.exists(path):
+            atomic_write(path, data)
+        atomic_write_json(os.path.join(out_dir, 'manifest.json'), manifest)
+        for old in glob.glob(os.path.join(out_dir, 'bundle-*.json.gz')):
+            if os.path.basename(old) != filename:
+                os.remove(old)
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="导出离线活动包")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--theme", choices=list(THEME_POI_MAP), help="团建主题，如：樱花季")
+    group.add_argument("--race", choices=list(RACE_CONFIG), help="赛事类型，如：短距离")
+    group.add_argument("--course", help="导出已保存（编辑过）的路线，即接口返回的course_id")
+    parser.add_argument("--courses", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'courses'),
+                        help="路线保存目录，与--course一起使用")
+    parser.add_argument("--out", required=True, help="输出目录")
+    parser.add_argument("--zooms", default="15,16,17", help="离线瓦片缩放级别，逗号分隔")
+    parser.add_argument("--tile-url", default=TILE_URL, help="瓦片服务地址模板，默认读取TILE_URL环境变量，为空时不打包瓦片")
+    parser.add_argument("--attribution", default=TILE_ATTRIBUTION, help="地图署名")
+    args = parser.parse_args()
+
+    explorer = LuojiaExplorer()
+    if args.course:
+        course = load_course(args.courses, args.course, explorer.get_route)
+        if course is None:
+            parser.error(f"路线不存在：{args.course}")
+    elif args.theme:
+        course = explorer.build_fun_course(args.theme)
+    else:
+        course = explorer.build_professional_course(args.race, "武汉大学信息学部操场", "武汉大学文理学部操场")
+    manifest = export_bundle(course, args.out, tuple(int(z) for z in args.zooms.split(',')), args.tile_url, args.attribution)
+    print(f"✅ 离线活动包已导出：{os.path.join(args.out, manifest['bundle'])}（{manifest['size']/1024:.1f} KB）")
+    if manifest["missing_tiles"]:
+        print(f"⚠️ 有{manifest['missing_tiles']}个瓦片下载失败，重新运行可补全")
@@ -0,0 +1,378 @@
+import argparse
+import gzip
+import json
+import os
+import re
+import struct
+import time
+import xml.etree.ElementTree as ET
+from array import array
+from datetime import datetime
+
+import numpy as np
+
+from campus_orientation import LuojiaExplorer, RACE_CONFIG, THEME_POI_MAP
+from event_bundle import course_payload
+from storage import atomic_write_json
+
+# FIT时间戳从1989-12-31 00:00:00 UTC开始计秒
+FIT_EPOCH = 631065600
+FIT_SEMICIRCLE = 180.0 / 2**31
+EARTH_RADIUS = 6371000.0
+
+
+def _parse_time(text):
+    if not text:
+        return float('nan')
+    text = text.strip().replace('Z', '+00:00')
+    # 统一小数秒位数，兼容Python 3.7-3.10的fromisoformat
+    text = re.sub(r'(\.\d+)', lambda m: m.group(1)[:7].ljust(7, '0'), text, count=1)
+    return datetime.fromisoformat(text).timestamp()
+
+
+def iter_gpx_points(fileobj):
+    """流式解析GPX轨迹点，逐个返回 (时间戳, 纬度, 经度)
+
+    每个元素（trkpt、wpt、rtept、extensions、metadata等）处理完后都会清空并从父节点移除，
+    树中只保留当前路径上的祖先节点，内存占用与文件大小无关。缺少坐标的trkpt会被跳过。
+    """
+    stack = []
+    timestamp = float('nan')
+    for event, elem in ET.iterparse(fileobj, events=("start", "end")):
+        tag = elem.tag.rsplit('}', 1)[-1]
+        if event == "start":
+            stack.append(elem)
+            if tag == "trkpt":
+                timestamp = float('nan')
+            continue
+        stack.pop()
+        if tag == "time" and stack and stack[-1].tag.rsplit('}', 1)[-1] == "trkpt":
+            # time子节点先于trkpt结束，在移除前记下时间
+            timestamp = _parse_time(elem.text)
+        elif tag == "trkpt":
+            lat, lon = elem.get("lat"), elem.get("lon")
+            if lat is not None and lon is not None:
+                yield timestamp, float(lat), float(lon)
+        elem.clear()
+        if stack:
+            stack[-1].remove(elem)
+
+
+def iter_fit_points(fileobj):
+    """流式解析FIT文件中的record消息，逐个返回 (时间戳, 纬度, 经度)"""
+    header = fileobj.read(1)
+    if not header:
+        return
+    header += fileobj.read(header[0] - 1)
+    if header[8:12] != b".FIT":
+        raise ValueError("不是有效的FIT文件")
+    remaining = struct.unpack('<I', header[4:8])[0]
+    definitions = {}
+    last_timestamp = None
+
+    while remaining > 0:
+        record_header = fileobj.read(1)[0]
+        remaining -= 1
+        compressed_offset = None
+        if record_header & 0x80:
+            # 压缩时间戳的数据消息
+            local_type = (record_header >> 5) & 0x03
+            compressed_offset = record_header & 0x1F
+        elif record_header & 0x40:
+            # 定义消息
+            local_type = record_header & 0x0F
+            fixed = fileobj.read(5)
+            endian = '>' if fixed[1] else '<'
+            global_num, field_count = struct.unpack(endian + 'HB', fixed[2:5])
+            raw = fileobj.read(field_count * 3)
+            fields = [(raw[i], raw[i+1], raw[i+2]) for i in range(0, len(raw), 3)]
+            size = 5 + len(raw)
+            dev_size = 0
+            if record_header & 0x20:
+                dev_count = fileobj.read(1)[0]
+                dev_raw = fileobj.read(dev_count * 3)
+                dev_size = sum(dev_raw[i+1] for i in range(0, len(dev_raw), 3))
+                size += 1 + len(dev_raw)
+            definitions[local_type] = (global_num, endian, fields, dev_size)
+            remaining -= size
+            continue
+        else:
+            local_type = record_header & 0x0F
+
+        global_num, endian, fields, dev_size = definitions[local_type]
+        values = {}
+        for number, size, base_type in fields:
+            data = fileobj.read(size)
+            if number in (0, 1) and size == 4:
+                values[number] = struct.unpack(endian + 'i', data)[0]
+            elif number == 253 and size == 4:
+                values[number] = struct.unpack(endian + 'I', data)[0]
+        fileobj.read(dev_size)
+        remaining -= sum(size for _, size, _ in fields) + dev_size
+
+        if 253 in values:
+            last_timestamp = values[253]
+        elif compressed_offset is not None and last_timestamp is not None:
+            timestamp = (last_timestamp & ~0x1F) + compressed_offset
+            if compressed_offset < (last_timestamp & 0x1F):
+                timestamp += 0x20
+            last_timestamp = timestamp
+        # 只取带有效坐标的record消息（global 20）
+        if global_num != 20 or values.get(0, 0x7FFFFFFF) == 0x7FFFFFFF or values.get(1, 0x7FFFFFFF) == 0x7FFFFFFF:
+            continue
+        timestamp = last_timestamp + FIT_EPOCH if last_timestamp is not None else float('nan')
+        yield timestamp, values[0] * FIT_SEMICIRCLE, values[1] * FIT_SEMICIRCLE
+
+
+def load_track(fileobj, filename):
+    """按扩展名流式读取GPX/FIT（支持.gz），返回时间、纬度、经度三个数组"""
+    name = filename.lower()
+    if name.endswith('.gz'):
+        fileobj = gzip.GzipFile(fileobj=fileobj)
+        name = name[:-3]
+    if name.endswith('.fit'):
+        points = iter_fit_points(fileobj)
+    elif name.endswith('.gpx'):
+        points = iter_gpx_points(fileobj)
+    else:
+        raise ValueError(f"不支持的轨迹格式：{filename}")
+
+    # 用紧凑的数组累积，每个轨迹点只占24字节
+    times, lats, lngs = array('d'), array('d'), array('d')
+    for timestamp, lat, lng in points:
+        times.append(timestamp)
+        lats.append(lat)
+        lngs.append(lng)
+    return np.frombuffer(times), np.frombuffer(lats), np.frombuffer(lngs)
+
+
+def project(lats, lngs, origin_lat):
+    """以origin_lat为基准的等距投影，返回以米为单位的平面坐标 (N, 2)"""
+    scale = np.pi / 180 * EARTH_RADIUS
+    return np.column_stack((np.asarray(lngs) * scale * np.cos(np.radians(origin_lat)), np.asarray(lats) * scale))
+
+
+class TrackIndex:
+    """轨迹点的网格空间索引，用于快速查找控制点附近的轨迹点"""
+    def __init__(self, xy, cell_size):
+        self.xy = xy
+        self.cell_size = cell_size
+        cells = np.floor(xy / cell_size).astype(np.int64)
+        self.keys = self._key(cells[:, 0], cells[:, 1])
+        self.order = np.argsort(self.keys, kind='stable')
+        self.sorted_keys = self.keys[self.order]
+
+    @staticmethod
+    def _key(cx, cy):
+        return cx * 2**32 + cy
+
+    def within(self, point, radius):
+        """返回与point距离不超过radius的轨迹点下标（升序）"""
+        cx, cy = np.floor(np.asarray(point) / self.cell_size).astype(np.int64)
+        reach = int(np.ceil(radius / self.cell_size))
+        offsets = np.arange(-reach, reach + 1)
+        keys = self._key(cx + offsets[:, None], cy + offsets[None, :]).ravel()
+        starts = np.searchsorted(self.sorted_keys, keys, side='left')
+        ends = np.searchsorted(self.sorted_keys, keys, side='right')
+        candidates = np.concatenate([self.order[s:e] for s, e in zip(starts, ends)])
+        dist = np.hypot(*(self.xy[candidates] - point).T)
+        return np.sort(candidates[dist <= radius])
+
+
+def distance_to_polyline(points, line):
+    """每个点到折线的最短距离（米），points: (M, 2)，line: (S+1, 2)"""
+    if len(line) < 2:
+        return np.hypot(*(points - line[0]).T)
+    a, b = line[:-1], line[1:]
+    ab = b - a
+    length2 = np.maximum((ab**2).sum(axis=1), 1e-9)
+    t = np.clip(((points[:, None, :] - a[None]) * ab[None]).sum(axis=2) / length2[None], 0, 1)
+    nearest = a[None] + t[:, :, None] * ab[None]
+    return np.hypot(*(points[:, None, :] - nearest).transpose(2, 0, 1)).min(axis=1)
+
+
+def analyse_track(course, times, lats, lngs, radius=30.0, deviation_threshold=50.0):
+    """把一条轨迹与路线比对，计算各赛段分段用时、实际与规划距离、路线偏离程度
+
+    course为event_bundle.course_payload的结果（或离线活动包中的course）。
+    控制点按顺序匹配：取上一控制点之后第一段连续位于radius范围内的轨迹点，
+    以其中离控制点最近的点作为打卡点，这样相邻赛段不会把经过控制点的那一段计入下一赛段。
+    """
+    points = course["points"]
+    if len(times) == 0:
+        return {"points": 0, "legs": [], "missing": [p["code"] for p in points], "total_time": None, "total_distance": 0.0}
+
+    origin_lat = float(np.mean(lats))
+    xy = project(lats, lngs, origin_lat)
+    step = np.hypot(*np.diff(xy, axis=0).T)
+    cumulative = np.concatenate(([0.0], np.cumsum(step)))
+    index = TrackIndex(xy, radius)
+
+    punches = []
+    previous = -1
+    for point in points:
+        target = project([point["location"]["lat"]], [point["location"]["lng"]], origin_lat)[0]
+        candidates = index.within(target, radius)
+        candidates = candidates[candidates > previous]
+        punch = None
+        if len(candidates):
+            # 第一段连续的范围内轨迹点（下标相邻）
+            breaks = np.flatnonzero(np.diff(candidates) != 1)
+            run = candidates[:breaks[0] + 1] if len(breaks) else candidates
+            punch = int(run[np.argmin(np.hypot(*(xy[run] - target).T))])
+            previous = punch
+        punches.append(punch)
+
+    legs = []
+    for i, leg in enumerate(course["legs"]):
+        start, end = punches[i], punches[i+1]
+        result = {
+            "from": leg["from"],
+            "to": leg["to"],
+            "planned_distance": leg["actual_distance"],
+            "straight_distance": leg["straight_distance"],
+            "punched": start is not None and end is not None
+        }
+        if result["punched"]:
+            segment = xy[start:end+1]
+            planned = np.array(leg["coordinates"], dtype=float)
+            deviation = distance_to_polyline(segment, project(planned[:, 0], planned[:, 1], origin_lat))
+            split = times[end] - times[start]
+            result.update({
+                "split_seconds": None if np.isnan(split) else float(split),
+                "actual_distance": float(cumulative[end] - cumulative[start]),
+                "mean_deviation": float(deviation.mean()),
+                "max_deviation": float(deviation.max())
+            })
+            result["distance_ratio"] = result["actual_distance"] / leg["actual_distance"] if leg["actual_distance"] > 0 else None
+            result["route_choice_changed"] = result["max_deviation"] > deviation_threshold
+        legs.append(result)
+
+    first = next((p for p in punches if p is not None), None)
+    last = next((p for p in reversed(punches) if p is not None), None)
+    total_time = None
+    if first is not None and punches[-1] is not None and not np.isnan(times[last] - times[first]):
+        total_time = float(times[last] - times[first])
+    return {
+        "points": len(times),
+        "legs": legs,
+        "missing": [p["code"] for p, punch in zip(points, punches) if punch is None],
+        "total_time": total_time,
+        "total_distance": float(cumulative[last] - cumulative[first]) if first is not None else 0.0
+    }
+
+
+def analyse_file(course, fileobj, filename, runner=None, **kwargs):
+    """读取并分析一条轨迹文件"""
+    times, lats, lngs = load_track(fileobj, filename)
+    result = analyse_track(course, times, lats, lngs, **kwargs)
+    name = os.path.basename(filename)
+    result["runner"] = runner or os.path.splitext(name[:-3] if name.lower().endswith('.gz') else name)[0]
+    result["file"] = name
+    return result
+
+
+def save_result(results_dir, event_id, result):
+    """把分析结果按赛事保存，不覆盖已有结果
+
+    选手名已被占用时（例如多名选手都上传了设备默认的activity.gpx）依次加上-2、-3等后缀，
+    result["runner"]会相应更新。
+    """
+    event_dir = os.path.join(results_dir, re.sub(r'[^\w\-]', '_', event_id))
+    os.makedirs(event_dir, exist_ok=True)
+    base = name = result["runner"]
+    suffix = 1
+    while True:
+        path = os.path.join(event_dir, re.sub(r'[^\w\-]', '_', name) + '.json')
+        try:
+            # 以独占方式创建文件占用名称，多个worker同时上传同名选手时不会互相覆盖
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            suffix += 1
+            name = f"{base}-{suffix}"
+    result["runner"] = name
+    atomic_write_json(path, result)
+    return path
+
+
+def load_results(results_dir, event_id):
+    """读取赛事的全部分析结果，按总用时排序（未完赛的排在最后）"""
+    event_dir = os.path.join(results_dir, re.sub(r'[^\w\-]', '_', event_id))
+    if not os.path.isdir(event_dir):
+        return []
+    results = []
+    for name in os.listdir(event_dir):
+        if name.endswith('.json'):
+            with open(os.path.join(event_dir, name), encoding='utf-8') as f:
+                try:
+                    results.append(json.load(f))
+                except json.JSONDecodeError:
+                    # 刚占用名称、尚未写入内容的结果
+                    continue
+    results.sort(key=lambda r: (r["total_time"] is None, r["total_time"] or 0))
+    return results
+
+
+def format_splits(result):
+    """生成单个选手的分段报告"""
+    text = f"🏃 {result['runner']}：共{result['points']}个轨迹点"
+    if result["total_time"] is not None:
+        text += f"，总用时{int(result['total_time']//60)}分{int(result['total_time']%60):02d}秒"
+    text += f"，跑动距离{result['total_distance']/1000:.2f} km\n"
+    for leg in result["legs"]:
+        if not leg["punched"]:
+            text += f"   【{leg['from']}-{leg['to']}】未打卡\n"
+            continue
+        split = "--" if leg["split_seconds"] is None else f"{int(leg['split_seconds']//60)}:{int(leg['split_seconds']%60):02d}"
+        text += f"   【{leg['from']}-{leg['to']}】用时{split} | 实际{leg['actual_distance']:.0f} m / 规划{leg['planned_distance']:.0f} m"
+        text += f" | 平均偏离{leg['mean_deviation']:.0f} m"
+        if leg["route_choice_changed"]:
+            text += "（选择了不同路线）"
+        text += "\n"
+    if result["missing"]:
+        text += f"   ⚠️ 未匹配到的点位：{', '.join(result['missing'])}\n"
+    return text
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="GPS轨迹分段用时分析")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--race", choices=list(RACE_CONFIG), help="按赛事类型生成路线")
+    group.add_argument("--theme", choices=list(THEME_POI_MAP), help="按团建主题生成路线")
+    group.add_argument("--bundle", help="使用离线活动包中的路线")
+    parser.add_argument("--event", help="赛事名称，指定后结果保存到 --results 目录")
+    parser.add_argument("--results", default="results", help="结果保存目录")
+    parser.add_argument("--radius", type=float, default=30.0, help="打卡判定半径（米）")
+    parser.add_argument("--runner", action="append", help="选手姓名，按顺序对应轨迹文件；默认使用文件名")
+    parser.add_argument("tracks", nargs="+", help="GPX/FIT轨迹文件")
+    args = parser.parse_args()
+
+    if args.bundle:
+        with gzip.open(args.bundle, 'rt', encoding='utf-8') as f:
+            course = json.load(f)["course"]
+    else:
+        explorer = LuojiaExplorer()
+        if args.theme:
+            course = course_payload(explorer.build_fun_course(args.theme))
+        else:
+            course = course_payload(explorer.build_professional_course(args.race, "武汉大学信息学部操场", "武汉大学文理学部操场"))
+
+    if args.runner and len(args.runner) != len(args.tracks):
+        parser.error("--runner的数量需要与轨迹文件数量一致")
+
+    started = time.time()
+    failed = 0
+    for i, path in enumerate(args.tracks):
+        try:
+            with open(path, 'rb') as f:
+                result = analyse_file(course, f, path, runner=args.runner[i] if args.runner else None, radius=args.radius)
+        except Exception as e:
+            # 单个文件损坏（截断的gz/FIT、非法XML等）不影响同批其他文件
+            failed += 1
+            print(f"❌ {path}：轨迹解析失败：{e}\n")
+            continue
+        if args.event:
+            save_result(args.results, args.event, result)
+        print(format_splits(result))
+    print(f"✅ 已分析{len(args.tracks) - failed}条轨迹，{failed}条失败，用时{time.time() - started:.1f}秒")
@@ -0,0 +1,55 @@
+import threading
+
+
+class _Call:
+    """一次正在进行中的计算"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """并发请求合并（single-flight）
+
+    同一时刻对同一个key发起的多次调用只会真正执行一次，
+    其余调用等待这次执行结束并共享它的结果（或异常）。
+    执行结束后key立即释放，不做结果缓存。
+    合并只在同一进程内有效：gunicorn -w 4 部署时，每个worker各自合并，
+    同一时刻的相同请求最多执行worker数量次。
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        """以key为去重依据执行fn，并发的相同key只执行一次"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            # 已有相同的计算在进行，等待其结果
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def in_flight(self):
+        """当前正在进行中的计算数量"""
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,45 @@
+import contextlib
+import json
+import os
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # Windows本地运行时没有fcntl，退化为不加锁
+    fcntl = None
+
+
+def atomic_write(path, data):
+    """原子写入文件：先写入同目录下唯一的临时文件，再替换目标文件
+
+    并发写入同一路径时各自使用独立的临时文件，最终结果为最后一次完整写入的内容。
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+
+def atomic_write_json(path, obj):
+    atomic_write(path, json.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8'))
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """跨进程的排他锁（gunicorn多个worker之间同样有效）"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)